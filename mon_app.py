@@ -1,24 +1,40 @@
 import streamlit as st
 import json
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
+from zoneinfo import ZoneInfo
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import time
+from google.oauth2.service_account import Credentials
+import re
+import zlib
+import base64
 import requests
+from functools import lru_cache
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson
+except ImportError:  # orjson optionnel : repli sur le json standard
+    orjson = None
 
 # ==============================================================================
 # CONFIG & CONNEXION
 # ==============================================================================
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+TZ = ZoneInfo("Europe/Paris")  # heure française, changements d'heure inclus
 
 @st.cache_resource
 def get_gspread_client():
     creds_dict = dict(st.secrets["gcp_service_account"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
     client = gspread.authorize(creds)
     return client
 
+@st.cache_resource
+def get_sheet():
+    return get_gspread_client().open("ProjetPoids_DB")
+
 TABS_MAPPING = {
     "recettes": "recettes",
     "plats": "plats",
@@ -27,25 +43,40 @@ TABS_MAPPING = {
     "journal": "journal",
     "poids": "poids"
 }
+DATA_KEYS = list(TABS_MAPPING)
 
 # --- OUTILS EXTERNES ---
-def search_openfoodfacts(query):
+# Session HTTP partagée : connexion keep-alive réutilisée d'une recherche à l'autre
+@st.cache_resource
+def get_http_session():
+    s = requests.Session()
+    s.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    s.headers.update({"User-Agent": "ProjetPoids/1.0"})
+    return s
+
+# Résultats gardés 1 h par requête : les reruns (filtre, clics) ne refont pas l'appel réseau.
+# Les erreurs remontent ici sans être mises en cache : la recherche suivante retente l'appel
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_openfoodfacts(query):
     url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={query}&search_simple=1&action=process&json=1"
+    r = get_http_session().get(url, timeout=5)
+    data = r.json()
+    results = []
+    if "products" in data:
+        for p in data["products"][:5]:
+            nutri = p.get("nutriments", {})
+            results.append({
+                "nom": p.get("product_name", "Inconnu"),
+                "kcal": int(nutri.get("energy-kcal_100g", 0)),
+                "prot": float(nutri.get("proteins_100g", 0)),
+                "gluc": float(nutri.get("carbohydrates_100g", 0)),
+                "lip": float(nutri.get("fat_100g", 0))
+            })
+    return results
+
+def search_openfoodfacts(query):
     try:
-        r = requests.get(url, timeout=5)
-        data = r.json()
-        results = []
-        if "products" in data:
-            for p in data["products"][:5]:
-                nutri = p.get("nutriments", {})
-                results.append({
-                    "nom": p.get("product_name", "Inconnu"),
-                    "kcal": int(nutri.get("energy-kcal_100g", 0)),
-                    "prot": float(nutri.get("proteins_100g", 0)),
-                    "gluc": float(nutri.get("carbohydrates_100g", 0)),
-                    "lip": float(nutri.get("fat_100g", 0))
-                })
-        return results
+        return _fetch_openfoodfacts(query.strip())
     except:
         return []
 
@@ -56,45 +87,121 @@ RAYONS = {
     "🥛 Crèmerie": ["crème", "beurre", "yaourt", "fromage", "lait", "oeuf", "skyr"],
     "🍝 Épicerie": ["pâtes", "riz", "pain", "farine", "sucre", "huile", "sel", "poivre", "sauce", "conserve"],
 }
+# Une regex par rayon (alternative des mots-clés, les plus longs d'abord), testées dans l'ordre de RAYONS
+_RAYON_RE = [(r, re.compile("|".join(map(re.escape, sorted(mots, key=len, reverse=True))))) for r, mots in RAYONS.items()]
+
+@lru_cache(maxsize=512)
 def detect_rayon(nom):
-    for r, mots in RAYONS.items():
-        if any(m in nom.lower() for m in mots): return r
-    return "🛒 Divers"
+    low = nom.lower()
+    return next((r for r, pat in _RAYON_RE if pat.search(low)), "🛒 Divers")
 
 # ==============================================================================
 # GESTION DONNÉES
 # ==============================================================================
+def json_dumps(data, sort_keys=False):
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(data, default=str, option=option).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, default=str, sort_keys=sort_keys)
+
+def json_loads(raw):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+# Contenu de la cellule A1 : JSON brut, ou "Z:" + base64(zlib(JSON)) au-delà de
+# COMPRESS_MIN caractères (3 à 5x plus petit, reste sous la limite de 50k d'une cellule)
+BLOB_PREFIX = "Z:"
+COMPRESS_MIN = 1024
+
+def encode_blob(data):
+    raw = json_dumps(data)
+    if len(raw) < COMPRESS_MIN: return raw
+    return BLOB_PREFIX + base64.b64encode(zlib.compress(raw.encode("utf-8"), 6)).decode("ascii")
+
+def decode_blob(cell):
+    if cell.startswith(BLOB_PREFIX):
+        return json_loads(zlib.decompress(base64.b64decode(cell[len(BLOB_PREFIX):])))
+    return json_loads(cell)  # anciennes cellules en JSON brut
+
+def to_num(x, cast=float):
+    return cast(0 if pd.isna(x) else x)
+
 def normalize_ingredient(val):
+    if val.__class__ is dict: return val  # cas courant (format V15) : aucune allocation
     if isinstance(val, (int, float)):
         return {"kcal": int(val), "prot": 0, "gluc": 0, "lip": 0}
     return val
 
-def fetch_from_cloud(key):
+# Entrée du garde-manger au format courant : macros /100 g + rayon calculé une fois pour toutes
+# (complété au chargement pour les anciennes entrées, enregistré à la prochaine sauvegarde)
+def pantry_entry(nom, val):
+    e = normalize_ingredient(val)
+    return e if "rayon" in e else {**e, "rayon": detect_rayon(nom)}
+
+def decode_tab(key, raw_data):
+    if not raw_data: return {}
     try:
-        client = get_gspread_client()
-        sh = client.open("ProjetPoids_DB")
-        worksheet = sh.worksheet(TABS_MAPPING[key])
-        raw_data = worksheet.acell('A1').value
-        if not raw_data: return {}
-        data = json.loads(raw_data)
-        if key == "garde_manger":
-            new_data = {}
-            for k, v in data.items():
-                new_data[k] = normalize_ingredient(v)
-            return new_data
-        return data
+        data = decode_blob(raw_data)
     except Exception as e:
         return {}
+    if key == "garde_manger":
+        return {k: pantry_entry(k, v) for k, v in data.items()}
+    return data
+
+# Une seule requête batchGet pour les 6 onglets (cellule A1 de chacun)
+# Cache partagé entre les reruns et les sessions, vidé après chaque écriture réussie ;
+# le TTL court borne le retard sur une modification faite hors de l'appli.
+# Une erreur réseau n'est pas mise en cache (exception).
+@st.cache_data(ttl=60, show_spinner=False)
+def load_all():
+    resp = get_sheet().values_batch_get([f"'{TABS_MAPPING[k]}'!A1" for k in DATA_KEYS])
+    data = {}
+    for k, vr in zip(DATA_KEYS, resp.get("valueRanges", [])):
+        values = vr.get("values")
+        data[k] = decode_tab(k, values[0][0] if values else None)
+    return data
+
+def fetch_all_from_cloud():
+    try:
+        data = load_all()
+    except Exception as e:
+        data = {}
+    return {k: data.get(k, {}) for k in DATA_KEYS}
+
+# Thread d'écriture partagé : un seul worker, les envois partent dans l'ordre des flush
+@st.cache_resource
+def get_writer():
+    return ThreadPoolExecutor(max_workers=1)
 
-def push_to_cloud(key, data):
+# Écrit plusieurs onglets {key: data} en une seule requête batchUpdate, sans bloquer le script.
+# Les blobs sont encodés ici (copie figée des données). Le cache de lecture est vidé dès la fin
+# de l'envoi (les autres sessions relisent la version écrite) ; les erreurs sont relevées par check_pushes()
+def push_to_cloud(updates):
     try:
-        client = get_gspread_client()
-        sh = client.open("ProjetPoids_DB")
-        worksheet = sh.worksheet(TABS_MAPPING[key])
-        json_str = json.dumps(data, ensure_ascii=False)
-        worksheet.update_acell('A1', json_str)
+        body = {
+            "valueInputOption": "RAW",
+            "data": [{"range": f"'{TABS_MAPPING[k]}'!A1", "values": [[encode_blob(v)]]} for k, v in updates.items()]
+        }
+        fut = get_writer().submit(get_sheet().values_batch_update, body)
+        fut.add_done_callback(lambda f: f.exception() is None and load_all.clear())
+        st.session_state.setdefault("_pushes", []).append((fut, set(updates)))
+        return True
     except Exception as e:
         st.error(f"Erreur cloud: {e}")
+        return False
+
+# Relève les envois terminés (ou les attend tous avec wait=True) : en cas d'échec,
+# les onglets concernés repassent "sales" et repartent au prochain flush
+def check_pushes(wait=False):
+    keep = []
+    for fut, keys in st.session_state.get("_pushes", []):
+        if not wait and not fut.done():
+            keep.append((fut, keys)); continue
+        try:
+            fut.result()
+        except Exception as e:
+            st.error(f"Erreur cloud: {e}")
+            st.session_state["_tracker"].failed(keys)
+    st.session_state["_pushes"] = keep
 
 DEFAULTS_PANTRY = {
     "Pâtes (Cru)": {"kcal": 360, "prot": 12, "gluc": 70, "lip": 1},
@@ -105,25 +212,148 @@ DEFAULTS_PANTRY = {
 }
 
 def init_state():
-    keys = ["recettes", "plats", "planning", "journal", "poids", "garde_manger"]
     if "data_loaded" not in st.session_state:
         with st.spinner('Chargement...'):
-            for k in keys:
-                st.session_state[k] = fetch_from_cloud(k)
-                time.sleep(0.2)
+            for k, v in fetch_all_from_cloud().items():
+                st.session_state[k] = v
+            st.session_state["_tracker"] = DirtyTracker({k: st.session_state[k] for k in DATA_KEYS})
             if not st.session_state["garde_manger"]:
-                st.session_state["garde_manger"] = DEFAULTS_PANTRY.copy()
-                push_to_cloud("garde_manger", st.session_state["garde_manger"])
+                st.session_state["garde_manger"] = {k: pantry_entry(k, v) for k, v in DEFAULTS_PANTRY.items()}
+                save_data("garde_manger", st.session_state["garde_manger"])
             st.session_state["data_loaded"] = True
     
     if "basket" not in st.session_state:
         st.session_state.basket = []
 
+# --- ÉCRITURES DIFFÉRÉES ---
+# save_data ne touche que la session : les onglets modifiés sont marqués "sales"
+# et envoyés ensemble par flush_dirty(), en fin de script ou juste avant un rerun().
+# Pas de délai entre deux envois : ils ne bloquent plus le script et un onglet "sale"
+# resterait sinon en attente jusqu'à la prochaine interaction.
+
+# Onglets à envoyer, comparés à une empreinte (JSON à clés triées) de leur dernier état connu
+# côté cloud : un enregistrement qui ne change rien, ou qui revient à l'état du cloud, n'écrit rien
+class DirtyTracker:
+    def __init__(self, data):
+        self.synced = {k: json_dumps(v, sort_keys=True) for k, v in data.items()}
+        self.pending = {}  # key -> empreinte à envoyer
+
+    def mark(self, key, value):
+        snap = json_dumps(value, sort_keys=True)
+        if snap == self.synced.get(key):
+            self.pending.pop(key, None)
+            return False
+        self.pending[key] = snap
+        return True
+
+    # Onglets à envoyer maintenant ; considérés synchronisés dès l'envoi (voir failed())
+    def take(self):
+        keys = list(self.pending)
+        self.synced.update(self.pending)
+        self.pending.clear()
+        return keys
+
+    def failed(self, keys):
+        for k in keys:
+            self.synced.pop(k, None)
+            self.mark(k, st.session_state[k])
+
+# Caches de session dérivés d'un onglet, à jeter dès qu'il est modifié
+DERIVED_KEYS = {"garde_manger": ["_pantry_lc", "_pantry_macros"], "recettes": ["_recettes_sorted", "_recipe_vecs"], "poids": ["_weight_df"]}
+# Clés des widgets initialisés à partir des données (planning, grille garde-manger, plats)
+DATA_WIDGET_PREFIXES = ("pl_ed_", "gm_editor_", "plats_ed_")
+
+# Renvoie False si les données sont identiques à celles du cloud (rien à envoyer)
 def save_data(key, new_data):
     st.session_state[key] = new_data
-    push_to_cloud(key, new_data)
-
-def get_today_str(): return datetime.now().strftime("%Y-%m-%d")
+    for d in DERIVED_KEYS.get(key, []): st.session_state.pop(d, None)
+    return st.session_state["_tracker"].mark(key, new_data)
+
+def flush_dirty():
+    tracker = st.session_state.get("_tracker")
+    if not tracker or not tracker.pending: return
+    keys = list(tracker.pending)
+    if push_to_cloud({k: st.session_state[k] for k in keys}):
+        tracker.take()
+
+# st.rerun() interrompt le script avant le flush de fin : on envoie d'abord les écritures en attente
+def rerun():
+    flush_dirty()
+    st.rerun()
+
+# Index de recherche du garde-manger : [(nom.casefold(), nom)] trié par nom
+def get_pantry_index():
+    if "_pantry_lc" not in st.session_state:
+        st.session_state["_pantry_lc"] = [(k.casefold(), k) for k in sorted(st.session_state["garde_manger"])]
+    return st.session_state["_pantry_lc"]
+
+# Noms de recettes triés + index nom -> position (selectbox),
+# gardés en session jusqu'à la prochaine modification des recettes
+def get_sorted_recettes():
+    if "_recettes_sorted" not in st.session_state:
+        names = sorted(st.session_state["recettes"])
+        st.session_state["_recettes_sorted"] = (names, {n: i for i, n in enumerate(names)})
+    return st.session_state["_recettes_sorted"]
+
+# Pesées triées par date (index DatetimeIndex), partagées par l'Oracle et la courbe
+def get_weight_df():
+    if "_weight_df" not in st.session_state:
+        poids = st.session_state["poids"]
+        dates = sorted(poids)  # dates ISO : ordre lexical = ordre chronologique
+        st.session_state["_weight_df"] = pd.DataFrame({"Poids": [poids[d] for d in dates]}, index=pd.DatetimeIndex(dates, name="Date"))
+    return st.session_state["_weight_df"]
+
+MACROS = ["kcal", "prot", "gluc", "lip"]
+JOURNAL_COLS = ["date", "heure", "recette", "poids", *MACROS]
+
+# Journal à plat (une ligne par prise) pour les agrégats vectorisés.
+# Le dict {date: [prises]} reste le format enregistré dans le cloud.
+# Macros arrondies en int32 : colonnes 2x plus compactes qu'en float64, sans débordement possible
+# (même arrondi que les totaux courants d'add_to_journal)
+def journal_frame(rows):
+    df = pd.DataFrame(rows, columns=JOURNAL_COLS)
+    df[MACROS] = df[MACROS].fillna(0).round().astype("int32")
+    return df
+
+def get_journal_df():
+    if "_journal_df" not in st.session_state:
+        journal = st.session_state["journal"]
+        st.session_state["_journal_df"] = journal_frame([{"date": d, **e} for d, entries in journal.items() for e in entries])
+    return st.session_state["_journal_df"]
+
+# Macros /100 g de chaque ingrédient sous forme de tuple (ordre MACROS), déjà normalisées :
+# les callbacks de saisie n'ont plus qu'une recherche + une multiplication par touche
+def get_pantry_macros():
+    if "_pantry_macros" not in st.session_state:
+        st.session_state["_pantry_macros"] = {
+            k: tuple(normalize_ingredient(v)[m] for m in MACROS) for k, v in st.session_state["garde_manger"].items()}
+    return st.session_state["_pantry_macros"]
+
+# Totaux d'une recette en vecteur (ordre MACROS), gardés en session par nom :
+# la mise à l'échelle du Cockpit se fait en une seule multiplication
+def get_recipe_vec(name):
+    vecs = st.session_state.setdefault("_recipe_vecs", {})
+    if name not in vecs:
+        r = st.session_state["recettes"][name]
+        vecs[name] = np.array([r['total_cal'], r.get('total_prot', 0), r.get('total_gluc', 0), r.get('total_lip', 0)], dtype=np.float64)
+    return vecs[name]
+
+# Totaux du jour gardés en session : calculés une fois par jour,
+# puis incrémentés à chaque ajout via add_to_journal()
+def get_today_totals(today):
+    t = st.session_state.get("_today_totals")
+    if not t or t["day"] != today:
+        df = get_journal_df()
+        sums = df.loc[df["date"] == today, MACROS].sum()
+        t = {"day": today, **{m: int(sums[m]) for m in MACROS}}
+        st.session_state["_today_totals"] = t
+    return t
+
+def add_to_journal(today, entry):
+    t = get_today_totals(today)
+    st.session_state["journal"].setdefault(today, []).append(entry)
+    st.session_state["_journal_df"] = pd.concat([get_journal_df(), journal_frame([{"date": today, **entry}])], ignore_index=True)
+    for m in MACROS: t[m] += round(entry.get(m, 0))
 
 # ==============================================================================
 # INTERFACE
@@ -132,6 +362,11 @@ st.set_page_config(page_title="Le Portionneur V18", page_icon="🥝", layout="wi
 st.title("🥝 Le Portionneur : V18")
 
 init_state()
+check_pushes()
+
+# Horloge lue une seule fois par run
+NOW_FR = datetime.now(TZ)
+today = NOW_FR.strftime("%Y-%m-%d")
 
 # Raccourcis
 recettes = st.session_state["recettes"]
@@ -141,37 +376,68 @@ journal = st.session_state["journal"]
 poids_data = st.session_state["poids"]
 pantry = st.session_state["garde_manger"]
 
+# Noms de recettes triés (gardés en session) + index nom -> position
+sorted_recettes, recette_index = get_sorted_recettes()
+# Idem pour les ingrédients, repris de l'index de recherche (déjà trié et gardé en session)
+pantry_options = [""] + [k for _, k in get_pantry_index()]
+
 MOMENTS = ["Matin", "Midi", "Collation", "Soir"]
 JOURS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+# Moment du repas pour chaque heure : Matin < 11h, Midi < 15h, Collation < 18h, puis Soir
+HOUR_TO_MOMENT = ["Matin"] * 11 + ["Midi"] * 4 + ["Collation"] * 3 + ["Soir"] * 6
 
 # --- SIDEBAR ---
+PAGES = {
+    "cockpit": "🏠 Cockpit", "oracle": "🔮 Oracle", "courses": "🛒 Courses", "garde_manger": "🥫 Garde-Manger (IA)",
+    "recettes": "👨‍🍳 Recettes", "planning": "📅 Planning", "poids": "⚖️ Poids", "plats": "🧽 Plats",
+}
+# Streamlit oublie l'état des widgets non affichés pendant un run : sans ça, changer de page
+# viderait la saisie en cours (recette en cours d'édition, pesée du Cockpit...).
+# Réaffecter la clé la fait passer en valeur de session, conservée d'une page à l'autre.
+KEEP_WIDGETS = ("m_s", "m_t", "m_p", "m_pl", "m_o", "d_n", "d_p", "rm", "rt", "rn", "ra_n", "ra_p", "ra_k")
+for k in KEEP_WIDGETS:
+    if k in st.session_state: st.session_state[k] = st.session_state[k]
 with st.sidebar:
+    # Page courante gardée dans l'URL (?page=...) : lien direct et rechargement sur la même page
+    qp_page = st.query_params.get("page")
+    page = st.radio("Page", list(PAGES), index=list(PAGES).index(qp_page) if qp_page in PAGES else 0,
+                    format_func=PAGES.get, key="page")
+    st.query_params["page"] = page
+
+    st.write("---")
     st.header("🎯 Objectifs")
     obj_cal = st.number_input("Cible Kcal Jour", 1500, 4000, 2000, step=50)
     st.caption(f"P: {int(obj_cal*0.3/4)}g | G: {int(obj_cal*0.4/4)}g | L: {int(obj_cal*0.3/9)}g")
     
     st.write("---")
     if st.button("🔄 Synchro"):
-        for k in list(st.session_state.keys()): del st.session_state[k]
+        # Ne recharge que les données (un seul batchGet) : client gspread, objectifs, plateau
+        # et recette en cours sont conservés. Les widgets pré-remplis depuis les données sont
+        # oubliés pour ne pas réécrire d'anciennes valeurs par-dessus celles du cloud.
+        flush_dirty()
+        check_pushes(wait=True)
+        load_all.clear()
+        for k in (*DATA_KEYS, "data_loaded", "_today_totals", "_journal_df", *chain.from_iterable(DERIVED_KEYS.values())):
+            st.session_state.pop(k, None)
+        for k in [k for k in st.session_state.keys() if k.startswith(DATA_WIDGET_PREFIXES)]:
+            del st.session_state[k]
         st.rerun()
     if st.button("🧹 Reset Semaine"):
-        st.session_state["planning"] = {}
-        st.session_state["journal"] = {}
-        push_to_cloud("planning", {})
-        push_to_cloud("journal", {})
+        save_data("planning", {})
+        save_data("journal", {})
+        st.session_state.pop("_today_totals", None)
+        st.session_state.pop("_journal_df", None)
         st.success("Semaine effacée !")
-        st.rerun()
-
-tabs = st.tabs(["🏠 Cockpit", "🔮 Oracle", "🛒 Courses", "🥫 Garde-Manger (IA)", "👨‍🍳 Recettes", "📅 Planning", "⚖️ Poids", "🧽 Plats"])
+        rerun()
 
+# ==============================================================================
+# PAGES (une fonction par page : seule la page affichée est exécutée)
+# ==============================================================================
 # --- 1. COCKPIT ---
-with tabs[0]:
-    today = get_today_str()
+def render_cockpit():
     if today not in journal: journal[today] = []
-    tot_k = sum([e['kcal'] for e in journal[today]])
-    tot_p = sum([e.get('prot', 0) for e in journal[today]])
-    tot_g = sum([e.get('gluc', 0) for e in journal[today]])
-    tot_l = sum([e.get('lip', 0) for e in journal[today]])
+    totals = get_today_totals(today)
+    tot_k, tot_p, tot_g, tot_l = (totals[m] for m in MACROS)
     
     st.markdown(f"### 📊 Total Jour : {int(tot_k)} / {obj_cal} kcal")
     st.progress(min(tot_k/obj_cal, 1.0))
@@ -186,21 +452,20 @@ with tabs[0]:
         st.subheader("🍲 Plat Cuisiné")
         if not recettes: st.warning("Crée des recettes !")
         else:
-            now = datetime.now() + timedelta(hours=1)
+            now = NOW_FR
             jour = JOURS[now.weekday()]
             h = now.hour
-            mom = "Matin" if h<11 else "Midi" if h<15 else "Collation" if h<18 else "Soir"
+            mom = HOUR_TO_MOMENT[h]
             
             idx, obj_repas = 0, 600
             if jour in planning and mom in planning[jour]:
                 p = planning[jour][mom]
                 if p["recette"] in recettes:
-                    idx = sorted(list(recettes.keys())).index(p["recette"])
+                    idx = recette_index[p["recette"]]
                     obj_repas = p["cible"]
                     st.info(f"📅 {jour} {mom} : {p['recette']}")
 
-            ch = st.selectbox("Recette", sorted(list(recettes.keys())), index=idx, key="m_s")
-            r_data = recettes[ch]
+            ch = st.selectbox("Recette", sorted_recettes, index=idx, key="m_s")
             
             c1, c2 = st.columns(2)
             with c1:
@@ -211,24 +476,23 @@ with tabs[0]:
                     pl = st.selectbox("Contenant", list(plats_vides.keys()), key="m_pl")
                     pn = max(0, pa - plats_vides[pl])
                     if pn > 0: st.caption(f"Nourriture: **{pn}g**")
-            with c2: ob = st.number_input("Cible Kcal", value=obj_repas, step=50, key="m_o")
+            with c2: ob = st.number_input("Cible Kcal", min_value=0, value=obj_repas, step=50, key="m_o")
             
             if pn > 0:
-                ratio = ob / r_data['total_cal']
+                vec = get_recipe_vec(ch)
+                ratio = ob / vec[0]
                 por = ratio * pn
-                fp = r_data.get('total_prot', 0) * ratio
-                fg = r_data.get('total_gluc', 0) * ratio
-                fl = r_data.get('total_lip', 0) * ratio
+                _, fp, fg, fl = vec * ratio
                 
                 st.success(f"👉 Sers-toi : **{int(por)} g**")
                 
                 if st.button("✅ Valider Recette", type="primary"):
-                    journal[today].append({
+                    add_to_journal(today, {
                         "heure": now.strftime("%H:%M"), "recette": ch, "poids": int(por), 
                         "kcal": ob, "prot": int(fp), "gluc": int(fg), "lip": int(fl)
                     })
                     save_data("journal", journal)
-                    st.rerun()
+                    rerun()
 
     with col_separateur:
         st.markdown("<div style='border-left:1px solid #333; height:500px'></div>", unsafe_allow_html=True)
@@ -241,16 +505,12 @@ with tabs[0]:
         def add_to_tray_callback():
             i = st.session_state.d_n
             w = st.session_state.d_p
-            if i and i in pantry and w > 0:
-                infos = normalize_ingredient(pantry[i])
-                f = w / 100
+            macros = get_pantry_macros().get(i)
+            if macros and w > 0:
                 st.session_state.basket.append({
                     "nom": i,
                     "poids": w,
-                    "kcal": int(infos['kcal'] * f),
-                    "prot": int(infos['prot'] * f),
-                    "gluc": int(infos['gluc'] * f),
-                    "lip": int(infos['lip'] * f)
+                    **{m: int(v * w / 100) for m, v in zip(MACROS, macros)}
                 })
                 # Reset propre des champs
                 st.session_state.d_n = ""
@@ -258,7 +518,7 @@ with tabs[0]:
         
         # Selecteur (avec calcul rapide visuel seulement)
         c_add1, c_add2 = st.columns([2, 1])
-        d_ing = c_add1.selectbox("Ingrédient", [""] + sorted(list(pantry.keys())), key="d_n")
+        d_ing = c_add1.selectbox("Ingrédient", pantry_options, key="d_n")
         d_pds = c_add2.number_input("Poids (g)", 0, step=10, key="d_p")
         
         # Bouton avec Callback
@@ -268,8 +528,9 @@ with tabs[0]:
         st.write("---")
         st.markdown("#### 🍽️ Ton Plateau")
         
-        bsk_tot_k = sum([x['kcal'] for x in st.session_state.basket])
-        bsk_tot_p = sum([x['prot'] for x in st.session_state.basket])
+        bsk_tot_k = bsk_tot_p = 0
+        for x in st.session_state.basket:
+            bsk_tot_k += x['kcal']; bsk_tot_p += x['prot']
         
         if not st.session_state.basket:
             st.info("Plateau vide.")
@@ -281,7 +542,7 @@ with tabs[0]:
                 c3.text(f"{item['kcal']}k")
                 if c4.button("X", key=f"rm_bsk_{i}"):
                     st.session_state.basket.pop(i)
-                    st.rerun()
+                    rerun()
             
             st.write("---")
             target_repas = st.number_input("🎯 Objectif repas (kcal)", value=600, step=50)
@@ -292,28 +553,31 @@ with tabs[0]:
             col_res2.metric("Protéines", f"{bsk_tot_p} g")
             
             if st.button("🍴 Tout Manger", type="primary", use_container_width=True):
-                now_h = datetime.now().strftime("%H:%M")
+                now_h = NOW_FR.strftime("%H:%M")
                 for item in st.session_state.basket:
-                    journal[today].append({
+                    add_to_journal(today, {
                         "heure": now_h, "recette": f"🔹 {item['nom']}", "poids": item['poids'],
                         "kcal": item['kcal'], "prot": item['prot'], "gluc": item['gluc'], "lip": item['lip']
                     })
                 save_data("journal", journal)
                 st.session_state.basket = []
-                st.success("Validé !")
-                time.sleep(1)
-                st.rerun()
+                # Toast non bloquant, conservé à travers le rerun (plus de pause du script)
+                st.toast("Miam ! Plateau ajouté au journal.", icon="🍴")
+                rerun()
 
 # --- 2. ORACLE ---
-with tabs[1]:
+def render_oracle():
     st.header("🔮 L'Oracle")
     if len(poids_data) < 2: st.warning("Il me faut au moins 2 pesées.")
     else:
-        dates = sorted(poids_data.keys())
-        p1, p2 = poids_data[dates[0]], poids_data[dates[-1]]
-        days = (datetime.strptime(dates[-1], "%Y-%m-%d") - datetime.strptime(dates[0], "%Y-%m-%d")).days
-        if days > 0:
-            vitesse = (p1 - p2) / days
+        df_w = get_weight_df()
+        # Tendance par régression linéaire sur toutes les pesées (pas seulement la première et la dernière)
+        t = (df_w.index - df_w.index[0]).days.to_numpy(dtype=np.float64)
+        y = df_w["Poids"].to_numpy(dtype=np.float64)
+        p2 = float(y[-1])
+        if t[-1] > 0:
+            slope, _ = np.polyfit(t, y, 1)
+            vitesse = -slope
             c1, c2 = st.columns(2)
             c1.metric("Vitesse", f"{vitesse*7:.2f} kg/semaine")
             if vitesse > 0:
@@ -322,21 +586,15 @@ with tabs[1]:
                 st.success(f"Objectif atteint dans {jours} jours !")
 
 # --- 3. COURSES (SANS PDF) ---
-with tabs[2]:
+def render_courses():
     st.header("🛒 Courses")
     if st.button("Générer la Liste"):
-        sh = {}
-        for j in planning:
-            for m in planning[j]:
-                r = planning[j][m]["recette"]
-                if r in recettes:
-                    for i in recettes[r]["ingredients"]: sh[i["nom"]] = sh.get(i["nom"], 0) + i["poids"]
-        
-        sh_tri = {}
-        for ing, poids in sh.items():
-            r = detect_rayon(ing)
-            if r not in sh_tri: sh_tri[r] = []
-            sh_tri[r].append((ing, poids))
+        planned = (slot["recette"] for day in planning.values() for slot in day.values())
+        rows = [(i["nom"], i["poids"]) for r in planned if r in recettes for i in recettes[r]["ingredients"]]
+        # Cumul par ingrédient puis regroupement par rayon côté pandas (ordre de première apparition conservé)
+        agg = pd.DataFrame(rows, columns=["nom", "poids"]).groupby("nom", sort=False, as_index=False)["poids"].sum()
+        agg["rayon"] = agg["nom"].map(lambda n: pantry.get(n, {}).get("rayon") or detect_rayon(n))
+        sh_tri = {ray: list(zip(g["nom"], g["poids"])) for ray, g in agg.groupby("rayon", sort=False)}
         
         cols = st.columns(2)
         idx=0
@@ -347,114 +605,155 @@ with tabs[2]:
             idx+=1
 
 # --- 4. GARDE MANGER ---
-with tabs[3]:
+def render_garde_manger():
     st.header("🥫 Ingrédients (IA)")
     with st.expander("🔎 Rechercher (OpenFoodFacts)", expanded=True):
         query = st.text_input("Recherche")
-        if query:
+        if len(query.strip()) < 3:
+            if query: st.caption("3 caractères minimum.")
+        else:
             res = search_openfoodfacts(query)
             for r in res:
                 c1, c2, c3 = st.columns([3, 2, 1])
                 c1.write(f"**{r['nom']}**")
                 c1.caption(f"{r['kcal']} kcal")
                 if c3.button("Ajouter", key=f"off_{r['nom']}"):
-                    pantry[r['nom']] = {"kcal": r['kcal'], "prot": r['prot'], "gluc": r['gluc'], "lip": r['lip']}
-                    save_data("garde_manger", pantry); st.rerun()
+                    pantry[r['nom']] = pantry_entry(r['nom'], {"kcal": r['kcal'], "prot": r['prot'], "gluc": r['gluc'], "lip": r['lip']})
+                    save_data("garde_manger", pantry); rerun()
 
     st.write("---")
-    search_gm = st.text_input("Filtrer")
-    items = pantry.items()
-    if search_gm: items = {k:v for k,v in pantry.items() if search_gm.lower() in k.lower()}.items()
-    for k, v in sorted(items):
-        vals = normalize_ingredient(v)
-        with st.expander(f"{k} ({vals['kcal']} kcal)"):
-            c1, c2, c3, c4, c5 = st.columns(5)
-            nk = c1.number_input("K", value=vals['kcal'], key=f"k_{k}")
-            np = c2.number_input("P", value=float(vals['prot']), key=f"p_{k}")
-            ng = c3.number_input("G", value=float(vals['gluc']), key=f"g_{k}")
-            nl = c4.number_input("L", value=float(vals['lip']), key=f"l_{k}")
-            if c5.button("💾", key=f"sv_{k}"):
-                pantry[k] = {"kcal": nk, "prot": np, "gluc": ng, "lip": nl}
-                save_data("garde_manger", pantry); st.rerun()
-            if c5.button("🗑️", key=f"dl_{k}"): del pantry[k]; save_data("garde_manger", pantry); st.rerun()
+    search_gm = st.text_input("Filtrer").casefold()
+    shown = [k for lc, k in get_pantry_index() if search_gm in lc]
+
+    # Une seule grille éditable (ajout / suppression de lignes) au lieu de 6 widgets par ingrédient
+    gm_cols = {"kcal": "Kcal", "prot": "P", "gluc": "G", "lip": "L"}  # même ordre que MACROS
+    pantry_macros = get_pantry_macros()
+    df_gm = pd.DataFrame([(k, *pantry_macros[k]) for k in shown], columns=["Nom", *gm_cols.values()])
+    # Dans un formulaire : les modifications de cellules ne relancent pas le script avant "Appliquer".
+    # Clé versionnée (et liée au filtre) : repart d'une grille propre après chaque enregistrement
+    with st.form("gm_form"):
+        edited = st.data_editor(df_gm, num_rows="dynamic", hide_index=True, width="stretch",
+                                key=f"gm_editor_{st.session_state.get('_gm_ver', 0)}_{search_gm}")
+        gm_submit = st.form_submit_button("💾 Appliquer", type="primary")
+
+    if gm_submit and not edited.equals(df_gm):
+        shown_set = set(shown)
+        new_pantry = {k: v for k, v in pantry.items() if k not in shown_set}  # lignes masquées par le filtre
+        for row in edited.to_dict("records"):
+            nom = row["Nom"].strip() if isinstance(row["Nom"], str) else ""
+            if not nom: continue
+            vals = {m: to_num(row[c], int if m == "kcal" else float) for m, c in gm_cols.items()}
+            # Ligne non modifiée : l'entrée d'origine est reprise telle quelle (champs annexes compris)
+            new_pantry[nom] = pantry[nom] if pantry_macros.get(nom) == tuple(vals.values()) else pantry_entry(nom, vals)
+        if new_pantry == pantry: st.info("Aucun changement"); return
+        st.session_state["_gm_ver"] = st.session_state.get("_gm_ver", 0) + 1
+        save_data("garde_manger", new_pantry); rerun()
 
 # --- 5. RECETTES ---
-with tabs[4]:
+def render_recettes():
     st.header("👨‍🍳 Recettes")
-    ls = sorted(list(recettes.keys()))
+    ls = sorted_recettes
     cg, cd = st.columns([1, 2])
     with cg:
         md = st.radio("Mode", ["Nouvelle", "Modifier", "Dupliquer", "Supprimer"], key="rm")
         tg = None if md=="Nouvelle" else st.selectbox("Recette", ls, key="rt")
-        if md=="Supprimer" and st.button("Confirmer"): del recettes[tg]; save_data("recettes", recettes); st.rerun()
+        if md=="Supprimer" and st.button("Confirmer"): del recettes[tg]; save_data("recettes", recettes); rerun()
 
     with cd:
         if md != "Supprimer":
             if 'ti' not in st.session_state or st.session_state.get('lm') != md or st.session_state.get('lt') != tg:
                 st.session_state.ti = []
                 if (md in ["Modifier", "Dupliquer"]) and tg: st.session_state.ti = recettes[tg]["ingredients"].copy()
+                # Totaux tenus à jour à chaque ajout : l'affichage ne re-somme pas la liste
+                t = st.session_state.ti_totals = {"k": 0, "p": 0, "g": 0, "l": 0}
+                for x in st.session_state.ti:
+                    t["k"] += x['cal']; t["p"] += x.get('prot', 0); t["g"] += x.get('gluc', 0); t["l"] += x.get('lip', 0)
                 st.session_state.lm = md; st.session_state.lt = tg
             
             dn = tg if md == "Modifier" and tg else f"{tg} (Copie)" if md=="Dupliquer" and tg else ""
             rn = st.text_input("Nom", value=dn, disabled=(md=="Modifier"), key="rn")
             
             def upd():
-                i, w = st.session_state.ra_n, st.session_state.ra_p
-                if i and i in pantry:
-                    infos = normalize_ingredient(pantry[i])
-                    f = w / 100
-                    st.session_state.ra_k = int(infos['kcal'] * f)
+                macros = get_pantry_macros().get(st.session_state.ra_n)
+                if macros: st.session_state.ra_k = int(macros[0] * st.session_state.ra_p / 100)
 
             c1, c2, c3, c4 = st.columns([3, 2, 2, 1])
-            ni = c1.selectbox("Ajout", [""] + sorted(list(pantry.keys())), key="ra_n", on_change=upd)
-            np = c2.number_input("g", 0, step=10, key="ra_p", on_change=upd)
+            ni = c1.selectbox("Ajout", pantry_options, key="ra_n", on_change=upd)
+            qte = c2.number_input("g", 0, step=10, key="ra_p", on_change=upd)
             nk = c3.number_input("kcal", 0, key="ra_k")
             if c4.button("➕") and ni:
-                infos = normalize_ingredient(pantry[ni])
-                f = np / 100
-                st.session_state.ti.append({"nom": ni, "poids": np, "cal": nk, "prot": infos['prot']*f, "gluc": infos['gluc']*f, "lip": infos['lip']*f})
+                _, mp, mg, ml = get_pantry_macros()[ni]
+                f = qte / 100
+                st.session_state.ti.append({"nom": ni, "poids": qte, "cal": nk, "prot": mp*f, "gluc": mg*f, "lip": ml*f})
+                t = st.session_state.ti_totals
+                t["k"] += nk; t["p"] += mp*f; t["g"] += mg*f; t["l"] += ml*f
             
             if st.session_state.ti:
                 st.table(pd.DataFrame(st.session_state.ti)[['nom', 'poids', 'cal']])
+                t = st.session_state.ti_totals
+                st.info(f"Total : {int(t['k'])} kcal | P: {int(t['p'])}g | G: {int(t['g'])}g | L: {int(t['l'])}g")
             else:
                 st.info("Aucun ingrédient.")
 
             if st.button("💾 Sauver") and rn:
-                recettes[rn] = {"total_cal": sum([x['cal'] for x in st.session_state.ti]), "total_prot": sum([x['prot'] for x in st.session_state.ti]), "ingredients": st.session_state.ti}
-                save_data("recettes", recettes); st.rerun()
+                t = st.session_state.ti_totals
+                recettes[rn] = {"total_cal": t["k"], "total_prot": t["p"], "ingredients": st.session_state.ti}
+                save_data("recettes", recettes); rerun()
 
 # --- 6. PLANNING & 7. POIDS/PLATS ---
-with tabs[5]:
-    lr = ["(Rien)"] + sorted(list(recettes.keys()))
-    if not planning: planning = {}
+def render_planning():
+    st.header("📅 Planning")
+    lr = ["(Rien)"] + sorted_recettes
+    # Une ligne par créneau (jour x moment) dans une seule grille, au lieu de 28 selectbox + number_input
+    rows = []
+    for j in JOURS:
+        for m in MOMENTS:
+            curr = planning.get(j, {}).get(m, {})
+            rec = curr.get("recette") if curr.get("recette") in recette_index else "(Rien)"
+            rows.append((j, m, rec, curr.get("cible", 600)))
+    df_pl = pd.DataFrame(rows, columns=["Jour", "Moment", "Recette", "Cible"])
     with st.form("pf"):
-        for j in JOURS:
-            if j not in planning: planning[j] = {}
-            with st.expander(j):
-                cs = st.columns(4)
-                for i, m in enumerate(MOMENTS):
-                    curr = planning[j].get(m, {})
-                    idx = lr.index(curr.get("recette", "(Rien)")) if curr.get("recette") in lr else 0
-                    nr = cs[i].selectbox(m, lr, index=idx, key=f"p_{j}_{m}")
-                    nc = 0
-                    if nr != "(Rien)": nc = cs[i].number_input("k", value=curr.get("cible", 600), step=50, key=f"pc_{j}_{m}")
-                    st.session_state[f"st_{j}_{m}"] = {"recette": nr, "cible": nc}
+        edited = st.data_editor(df_pl, hide_index=True, width="stretch", disabled=["Jour", "Moment"],
+                                column_config={"Recette": st.column_config.SelectboxColumn(options=lr, required=True),
+                                               "Cible": st.column_config.NumberColumn("Cible (kcal)", min_value=0, step=50)},
+                                key=f"pl_ed_{st.session_state.get('_pl_ver', 0)}")
         if st.form_submit_button("Sauver"):
-            np = {}
-            for j in JOURS:
-                np[j] = {}
-                for m in MOMENTS:
-                    if st.session_state[f"st_{j}_{m}"]["recette"] != "(Rien)": np[j][m] = st.session_state[f"st_{j}_{m}"]
-            save_data("planning", np); st.rerun()
-
-with tabs[6]:
+            # Jours vides omis : même forme que le planning chargé, un "Sauver" sans modification n'écrit rien
+            new_plan = {}
+            for j, m, rec, cible in edited.itertuples(index=False, name=None):
+                if rec in recette_index: new_plan.setdefault(j, {})[m] = {"recette": rec, "cible": to_num(cible, int)}
+            if save_data("planning", new_plan):
+                st.session_state["_pl_ver"] = st.session_state.get("_pl_ver", 0) + 1
+                rerun()
+            else: st.info("Aucun changement")
+
+def render_poids():
+    st.header("⚖️ Poids")
     w = st.number_input("Kg", 0.0, key="wp")
-    if st.button("S") and w>0: poids_data[today]=w; save_data("poids", poids_data); st.rerun()
-    if poids_data: st.line_chart(pd.DataFrame({"Date": sorted(poids_data.keys()), "Poids": [poids_data[d] for d in sorted(poids_data.keys())]}).set_index("Date"))
+    if st.button("S") and w>0: poids_data[today]=w; save_data("poids", poids_data); rerun()
+    if poids_data: st.line_chart(get_weight_df())
 
-with tabs[7]:
+def render_plats():
+    st.header("🧽 Plats")
     pn = st.text_input("Nom"); pw = st.number_input("Poids", 0)
-    if st.button("Ajouter") and pn: plats_vides[pn]=pw; save_data("plats", plats_vides); st.rerun()
-    for k,v in plats_vides.items():
-        st.write(f"{k}: {v}"); 
-        if st.button("X", key=f"pd_{k}"): del plats_vides[k]; save_data("plats", plats_vides); st.rerun()
+    if st.button("Ajouter") and pn: plats_vides[pn]=pw; save_data("plats", plats_vides); rerun()
+    if plats_vides:
+        # Renommage / poids / suppression de tous les plats dans une seule grille, validée en une fois
+        df_pl = pd.DataFrame([(k, v, False) for k, v in plats_vides.items()], columns=["Plat", "Poids", "🗑️"])
+        with st.form("plats_form"):
+            edited = st.data_editor(df_pl, num_rows="dynamic", hide_index=True, width="stretch",
+                                    key=f"plats_ed_{st.session_state.get('_plats_ver', 0)}")
+            if st.form_submit_button("Appliquer"):
+                new_plats = {nom.strip(): to_num(poids, int) for nom, poids, suppr in edited.itertuples(index=False, name=None)
+                             if isinstance(nom, str) and nom.strip() and not suppr}
+                if new_plats != plats_vides:
+                    st.session_state["_plats_ver"] = st.session_state.get("_plats_ver", 0) + 1
+                    save_data("plats", new_plats); rerun()
+
+{
+    "cockpit": render_cockpit, "oracle": render_oracle, "courses": render_courses, "garde_manger": render_garde_manger,
+    "recettes": render_recettes, "planning": render_planning, "poids": render_poids, "plats": render_plats,
+}[page]()
+
+# Envoi groupé des modifications de ce run (les boutons qui relancent passent par rerun())
+flush_dirty()